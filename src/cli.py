@@ -1,74 +1,170 @@
 import argparse
+import asyncio
+import atexit
+import heapq
+import json
+import os
 import socket
 import sys
-from data_model import build_data_model
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from data_model import LogModel, build_data_model, iter_connections, write_json
+from log_parser import positive_int
+
+try:
+    import aiodns
+except ImportError:
+    # Optional dependency; without it lookups fall back to a thread pool.
+    aiodns = None
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the on-disk cache is then used without locking.
+    fcntl = None
 
 # Cache for hostname resolution to avoid repeated lookups
 hostname_cache = {}
-
-def print_src_ip_table(connections, resolve_hostnames=False):
-    """Prints a table of connections with source IP, bind, and unbind times."""
-    print(f"{'Source IP':<20} {'Bind Timestamp':<35} {'Unbind Timestamp':<35}")
-    print(f"{'--------------------':<20} {'-----------------------------------':<35} {'-----------------------------------':<35}")
-
-    sorted_connections = sorted(
-        [c for c in connections.values() if c.successful_bind and c.unbind_timestamp and c.bind_timestamp],
-        key=lambda c: c.bind_timestamp
+hostname_cache_lock = threading.Lock()
+
+# Upper bound for concurrent reverse lookups when pre-resolving a table
+MAX_RESOLVER_THREADS = 64
+
+# On-disk cache of successful reverse lookups, shared between runs
+HOSTNAME_CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    '389ds-log-analyser', 'ptr.json'
+)
+HOSTNAME_CACHE_TTL = 24 * 60 * 60
+
+# Resolution times of the entries loaded from the on-disk cache
+hostname_cache_resolved_at = {}
+
+# Maximum number of table rows joined into a single write to stdout
+WRITE_BATCH_SIZE = 65536
+
+# Row layouts of the tables. The bound str.format methods are created once and
+# are cheaper per row than an f-string with a format spec for every column.
+SRC_IP_TABLE_ROW = "{:<20} {:<35} {:<35}".format
+OPEN_CONNECTIONS_ROW = "{:<20} {:<50} {:<35}".format
+UNINDEXED_SEARCHES_ROW = "{:<35} {:<10} {:<10} {:<30} {}".format
+
+# Subcommands that print a query over the data model
+QUERY_COMMANDS = ('src-ip-table', 'open-connections', 'unique-clients', 'unindexed-searches')
+
+def write_lines(lines):
+    """Writes lines to stdout in large batches instead of one print() call per line."""
+    write = sys.stdout.write
+    for start in range(0, len(lines), WRITE_BATCH_SIZE):
+        write("\n".join(lines[start:start + WRITE_BATCH_SIZE]) + "\n")
+
+def sorted_rows(rows, key, limit=None):
+    """Returns rows sorted by key, or only the first limit rows if a limit is given."""
+    if limit is not None:
+        # Keeps a heap of limit rows instead of sorting everything: O(n log limit)
+        return heapq.nsmallest(limit, rows, key=key)
+    return sorted(rows, key=key)
+
+def all_connections(connections):
+    """
+    Returns every connection of a LogModel as returned by build_data_model, including
+    earlier connections whose number was reused. A plain dict of connections also works.
+    """
+    if isinstance(connections, LogModel):
+        return connections.all_connections
+    return list(connections.values())
+
+def completed_connections(connections):
+    """Returns the successfully bound connections that were closed."""
+    if isinstance(connections, LogModel):
+        return connections.completed_connections
+    return [c for c in connections.values() if c.successful_bind and c.unbind_timestamp and c.bind_timestamp]
+
+def open_connections(connections):
+    """Returns the successfully bound connections that are still open."""
+    if isinstance(connections, LogModel):
+        return connections.open_connections
+    return [c for c in connections.values() if c.successful_bind and c.unbind_timestamp is None]
+
+def print_src_ip_table(connections, resolve_hostnames=False, limit=None):
+    """Prints a table of completed connections with source IP, bind, and unbind times."""
+    print(SRC_IP_TABLE_ROW('Source IP', 'Bind Timestamp', 'Unbind Timestamp'))
+    print(SRC_IP_TABLE_ROW('-' * 20, '-' * 35, '-' * 35))
+
+    # Project only the printed columns in a single pass and sort the compact rows
+    rows = sorted_rows(
+        ((c.bind_timestamp, c.source_ip, c.unbind_timestamp) for c in completed_connections(connections)),
+        key=itemgetter(0),
+        limit=limit
     )
 
-    for conn in sorted_connections:
-        source_ip = conn.source_ip or "N/A"
+    if resolve_hostnames:
+        prewarm_hostnames(ip for _, ip, _ in rows if ip)
+
+    lines = []
+    for bind_timestamp, source_ip, unbind_timestamp in rows:
+        source_ip = source_ip or "N/A"
         if resolve_hostnames:
             source_ip = resolve_hostname(source_ip)
-        bind_time = conn.bind_timestamp.isoformat() if conn.bind_timestamp else "N/A"
-        unbind_time = conn.unbind_timestamp.isoformat() if conn.unbind_timestamp else "N/A"
-        print(f"{source_ip:<20} {bind_time:<35} {unbind_time:<35}")
+        # Both timestamps are set on completed connections
+        lines.append(SRC_IP_TABLE_ROW(source_ip, bind_timestamp.isoformat(), unbind_timestamp.isoformat()))
+    write_lines(lines)
 
-def print_open_connections_table(connections, resolve_hostnames=False):
+def print_open_connections_table(connections, resolve_hostnames=False, limit=None):
     """Prints a table of open connections with source IP, bind DN, and bind time."""
-    print(f"{'Source IP':<20} {'Bind DN':<50} {'Bind Timestamp':<35}")
-    print(f"{'--------------------':<20} {'--------------------------------------------------':<50} {'-----------------------------------':<35}")
-
-    sorted_connections = sorted(
-        [c for c in connections.values() if c.successful_bind and c.unbind_timestamp is None],
-        key=lambda c: c.bind_timestamp
+    print(OPEN_CONNECTIONS_ROW('Source IP', 'Bind DN', 'Bind Timestamp'))
+    print(OPEN_CONNECTIONS_ROW('-' * 20, '-' * 50, '-' * 35))
+
+    # Project only the printed columns in a single pass and sort the compact rows
+    rows = sorted_rows(
+        ((c.bind_timestamp, c.source_ip, c.bind_dn) for c in open_connections(connections)),
+        key=itemgetter(0),
+        limit=limit
     )
 
-    for conn in sorted_connections:
-        source_ip = conn.source_ip or "N/A"
+    if resolve_hostnames:
+        prewarm_hostnames(ip for _, ip, _ in rows if ip)
+
+    lines = []
+    for bind_timestamp, source_ip, bind_dn in rows:
+        source_ip = source_ip or "N/A"
         if resolve_hostnames:
             source_ip = resolve_hostname(source_ip)
-        bind_dn = conn.bind_dn or "N/A"
-        bind_time = conn.bind_timestamp.isoformat() if conn.bind_timestamp else "N/A"
-        print(f"{source_ip:<20} {bind_dn:<50} {bind_time:<35}")
+        bind_dn = bind_dn or "N/A"
+        bind_time = bind_timestamp.isoformat() if bind_timestamp else "N/A"
+        lines.append(OPEN_CONNECTIONS_ROW(source_ip, bind_dn, bind_time))
+    write_lines(lines)
 
 def print_unique_clients(connections, resolve_hostnames=False):
     """Prints a unique list of all client source IPs."""
     print("Unique Client IPs")
     print("-----------------")
     
-    unique_ips = sorted(list(set(c.source_ip for c in connections.values() if c.source_ip)))
-    
-    for ip in unique_ips:
-        if resolve_hostnames:
-            ip = resolve_hostname(ip)
-        print(ip)
+    unique_ips = sorted(list(set(c.source_ip for c in all_connections(connections) if c.source_ip)))
 
-def print_unindexed_searches_table(connections):
-    """Prints a table of partially unindexed searches."""
-    print(f"{'Timestamp':<35} {'Conn':<10} {'Op':<10} {'Base':<30} {'Filter'}")
-    print(f"{'-----------------------------------':<35} {'----------':<10} {'----------':<10} {'------------------------------':<30} {'-'*40}")
+    if resolve_hostnames:
+        prewarm_hostnames(unique_ips)
+        unique_ips = [resolve_hostname(ip) for ip in unique_ips]
+    write_lines(unique_ips)
 
-    unindexed_searches = []
-    for conn in connections.values():
-        for op in conn.operations.values():
-            if op.op_type == 'SRCH' and op.result and op.result.get('details') == 'Partially Unindexed Filter':
-                unindexed_searches.append((op.timestamp, conn.conn_num, op.op_num, op.data.get('base', 'N/A'), op.data.get('filter', 'N/A')))
-
-    unindexed_searches.sort(key=lambda x: x[0])
+def print_unindexed_searches_table(connections, limit=None):
+    """Prints a table of partially unindexed searches."""
+    print(UNINDEXED_SEARCHES_ROW('Timestamp', 'Conn', 'Op', 'Base', 'Filter'))
+    print(UNINDEXED_SEARCHES_ROW('-' * 35, '-' * 10, '-' * 10, '-' * 30, '-' * 40))
+
+    unindexed_searches = sorted_rows(
+        ((op.timestamp, conn.conn_num, op.op_num, op.data.get('base', 'N/A'), op.data.get('filter', 'N/A'))
+         for conn in all_connections(connections) for op in conn.unindexed_searches),
+        key=itemgetter(0),
+        limit=limit
+    )
 
-    for ts, conn_num, op_num, base, sfilter in unindexed_searches:
-        print(f"{ts.isoformat():<35} {conn_num:<10} {op_num:<10} {base:<30} {sfilter}")
+    write_lines([
+        UNINDEXED_SEARCHES_ROW(ts.isoformat(), conn_num, op_num, base, sfilter)
+        for ts, conn_num, op_num, base, sfilter in unindexed_searches
+    ])
 
 def resolve_hostname(ip_address):
     """Resolves an IP address to a hostname, with caching."""
@@ -76,24 +172,141 @@ def resolve_hostname(ip_address):
         return hostname_cache[ip_address]
     try:
         hostname, _, _ = socket.gethostbyaddr(ip_address)
-        hostname_cache[ip_address] = hostname
-        return hostname
     except (socket.herror, socket.gaierror):
         # If resolution fails, cache and return the original IP
-        hostname_cache[ip_address] = ip_address
-        return ip_address
+        hostname = ip_address
+    with hostname_cache_lock:
+        hostname_cache[ip_address] = hostname
+    return hostname
+
+def prewarm_hostnames(ip_addresses):
+    """Resolves IP addresses concurrently so that later lookups hit the cache."""
+    pending = {ip for ip in ip_addresses if ip not in hostname_cache}
+    if not pending:
+        return
+    if aiodns is not None:
+        # Send the PTR queries for these rows as one batch of asynchronous lookups
+        asyncio.run(resolve_hostnames_batch(pending))
+        return
+    # Reverse lookups are network-bound, so overlapping them in threads cuts
+    # the wall time from one round-trip per address to roughly one per batch.
+    with ThreadPoolExecutor(max_workers=min(MAX_RESOLVER_THREADS, len(pending))) as executor:
+        list(executor.map(resolve_hostname, pending))
+
+async def resolve_hostnames_batch(ip_addresses):
+    """Resolves IP addresses with concurrent aiodns PTR queries and caches the results."""
+    resolver = aiodns.DNSResolver()
+
+    async def lookup(ip_address):
+        try:
+            result = await resolver.gethostbyaddr(ip_address)
+        except (aiodns.error.DNSError, ValueError):
+            # If resolution fails (or the source is not an IP), keep the original IP
+            return ip_address
+        return result.name
+
+    pending = [ip for ip in set(ip_addresses) if ip not in hostname_cache]
+    hostnames = await asyncio.gather(*(lookup(ip) for ip in pending))
+    with hostname_cache_lock:
+        hostname_cache.update(zip(pending, hostnames))
+
+def _read_cache_entries(f):
+    """Returns the unexpired {ip: [hostname, resolved_at]} entries of an open cache file."""
+    try:
+        entries = json.load(f)
+    except ValueError:
+        return {}
+    if not isinstance(entries, dict):
+        return {}
+    now = time.time()
+    return {
+        ip: entry for ip, entry in entries.items()
+        if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str)
+        and isinstance(entry[1], (int, float)) and now - entry[1] <= HOSTNAME_CACHE_TTL
+    }
+
+def load_hostname_cache(path=HOSTNAME_CACHE_FILE):
+    """Loads unexpired hostnames from the on-disk cache into hostname_cache."""
+    try:
+        with open(path, 'r') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            entries = _read_cache_entries(f)
+    except OSError:
+        return
+    with hostname_cache_lock:
+        for ip, (hostname, resolved_at) in entries.items():
+            if ip not in hostname_cache:
+                hostname_cache[ip] = hostname
+                hostname_cache_resolved_at[ip] = resolved_at
+
+def save_hostname_cache(path=HOSTNAME_CACHE_FILE):
+    """Merges the successful lookups of this run into the on-disk cache."""
+    now = time.time()
+    resolved = {
+        ip: [hostname, hostname_cache_resolved_at.get(ip, now)]
+        for ip, hostname in hostname_cache.items() if hostname != ip
+    }
+    if not resolved:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+') as f:
+            if fcntl:
+                # Held until the file is closed, so concurrent runs merge instead of clobbering
+                fcntl.flock(f, fcntl.LOCK_EX)
+            entries = _read_cache_entries(f)
+            entries.update(resolved)
+            f.seek(0)
+            f.truncate()
+            json.dump(entries, f)
+    except OSError:
+        # The cache is only an optimization; never fail the query because of it
+        pass
+
+def run_query(command, connections, resolve_hostnames=False, limit=None):
+    """Prints the output of one of the QUERY_COMMANDS for an already built data model."""
+    if command == 'src-ip-table':
+        print_src_ip_table(connections, resolve_hostnames, limit)
+    elif command == 'open-connections':
+        print_open_connections_table(connections, resolve_hostnames, limit)
+    elif command == 'unique-clients':
+        print_unique_clients(connections, resolve_hostnames)
+    elif command == 'unindexed-searches':
+        print_unindexed_searches_table(connections, limit)
 
 def main():
     # Parent parser for common arguments that all subcommands will use
     parent_parser = argparse.ArgumentParser(add_help=False)
     parent_parser.add_argument('-f', '--file', required=True, help='Path to the log file.')
-    parent_parser.add_argument('--debug', action='store_true', help='Enable debug output for parsing errors.')
+    parent_parser.add_argument('--debug', action='store_true', help='Print lines that could not be parsed or were ignored to stderr.')
     parent_parser.add_argument(
         '--filter-client-ip',
         nargs='+',
         metavar='IP_ADDRESS',
         help='Filter output by one or more client IP addresses.'
     )
+    parent_parser.add_argument(
+        '--also',
+        nargs='+',
+        default=[],
+        choices=QUERY_COMMANDS,
+        metavar='COMMAND',
+        help='Run further commands against the same parsed log, e.g. --also unique-clients.'
+    )
+    parent_parser.add_argument(
+        '--limit',
+        type=positive_int,
+        metavar='N',
+        help='Only print the N earliest rows of the src-ip-table, open-connections and unindexed-searches tables.'
+    )
+    parent_parser.add_argument(
+        '-j', '--jobs',
+        type=positive_int,
+        default=1,
+        metavar='N',
+        help='Number of worker processes used to parse the log file (default: 1).'
+    )
     parent_parser.add_argument(
         '--resolve-hostnames',
         action='store_true',
@@ -136,26 +349,43 @@ def main():
     )
     parser_unindexed.set_defaults(func=print_unindexed_searches_table)
 
-    args = parser.parse_args()
-
-    connections = build_data_model(args.file, args.debug)
-
-    if args.filter_client_ip:
-        connections = {
-            conn_num: conn for conn_num, conn in connections.items()
-            if conn.source_ip in args.filter_client_ip
-        }
-
-    filtered_connections = connections
+    # json command
+    parser_json = subparsers.add_parser(
+        'json',
+        help='Write all connections and their operations as a JSON array.',
+        parents=[parent_parser]
+    )
+    parser_json.set_defaults(func=write_json)
 
-    if args.command == 'src-ip-table':
-        print_src_ip_table(filtered_connections, args.resolve_hostnames)
-    elif args.command == 'open-connections':
-        print_open_connections_table(filtered_connections, args.resolve_hostnames)
-    elif args.command == 'unique-clients':
-        print_unique_clients(filtered_connections, args.resolve_hostnames)
-    elif args.command == 'unindexed-searches':
-        print_unindexed_searches_table(filtered_connections)
+    args = parser.parse_args()
+    if args.command == 'json':
+        # JSON output is meant to be piped into other tools: no tables may follow it,
+        # and it always lists every connection with its source IP as logged.
+        for option, value in (('--also', args.also), ('--limit', args.limit),
+                              ('--resolve-hostnames', args.resolve_hostnames)):
+            if value:
+                parser.error(f'json cannot be combined with {option}')
+
+    if args.resolve_hostnames:
+        load_hostname_cache()
+        atexit.register(save_hostname_cache)
+
+    # The client IP filter is applied while parsing, so dropped connections are never built.
+    # Interned like the source IPs in the model, so matches are usually identity checks.
+    filter_ips = frozenset(sys.intern(ip) for ip in args.filter_client_ip) if args.filter_client_ip else None
+
+    if args.command == 'json':
+        # Nothing needs the whole model, so each connection is written shortly after it is closed.
+        write_json(sys.stdout, iter_connections(args.file, args.debug, args.jobs, filter_ips))
+        return
+
+    filtered_connections = build_data_model(args.file, args.debug, args.jobs, filter_ips)
+
+    # The log is parsed once; every requested command runs against the same model.
+    for i, command in enumerate(dict.fromkeys([args.command] + args.also)):
+        if i:
+            print()
+        run_query(command, filtered_connections, args.resolve_hostnames, args.limit)
 
 if __name__ == '__main__':
     main()
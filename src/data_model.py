@@ -1,12 +1,49 @@
+import json
+import sys
+from collections import deque
 from datetime import datetime
+from itertools import chain
 
 
 
 # Assuming log_parser.py is in the same directory or accessible
-from log_parser import parse_log_line
+from log_parser import parse_log_file
+
+# A closed connection can still get lines, e.g. a second 'closed'/'Disconnect'
+# line or the RESULT of an abandoned operation. It is kept for this many further
+# connection lines before it is yielded as complete.
+CLOSED_CONNECTION_GRACE_LINES = 10000
+
+# RESULT details that mark a search as (partially) unindexed
+UNINDEXED_SEARCH_DETAILS = 'Partially Unindexed Filter'
+
+# Fields whose values repeat across many lines (a handful of bind DNs, search
+# bases and application filters), per operation type. They are interned so that
+# every repetition shares one string object.
+INTERNED_FIELDS = {
+    'BIND': ('dn',),
+    'SRCH': ('base', 'filter'),
+}
+
+def _intern_fields(data, keys):
+    """Interns the string values of the given keys in a parsed line, in place."""
+    for key in keys:
+        value = data.get(key)
+        if type(value) is str:
+            data[key] = sys.intern(value)
+
+def _with_iso_timestamp(payload):
+    """Returns a copy of a parsed payload with a datetime 'timestamp' value converted to an ISO string."""
+    timestamp = payload.get('timestamp')
+    if isinstance(timestamp, datetime):
+        return {**payload, 'timestamp': timestamp.isoformat()}
+    return payload.copy()
 
 class Operation:
     """Represents a single operation within a connection."""
+    # One instance is created per logged operation, so avoid a per-instance __dict__.
+    __slots__ = ('op_num', 'op_type', 'timestamp', 'data', 'extra_text', 'result')
+
     def __init__(self, op_num, op_type, timestamp, data, extra_text=None):
         self.op_num = op_num
         self.op_type = op_type
@@ -19,46 +56,58 @@ class Operation:
         """Converts the operation to a dictionary for JSON serialization."""
         # The 'data' and 'result' fields are dictionaries that might contain
         # a datetime object from the parser. We need to convert it to a string.
-        data_payload = self.data.copy()
-        if 'timestamp' in data_payload and isinstance(data_payload.get('timestamp'), datetime):
-            data_payload['timestamp'] = data_payload['timestamp'].isoformat()
-
         data_dict = {
             "op_num": self.op_num,
             "type": self.op_type,
             "timestamp": self.timestamp.isoformat() if self.timestamp else None,
-            "data": data_payload,
+            "data": _with_iso_timestamp(self.data),
         }
         if self.extra_text:
             data_dict["extra_text"] = self.extra_text
         if self.result:
-            if isinstance(self.result, dict):
-                result_payload = self.result.copy()
-                if 'timestamp' in result_payload and isinstance(result_payload.get('timestamp'), datetime):
-                    result_payload['timestamp'] = result_payload['timestamp'].isoformat()
-                data_dict["result"] = result_payload
-            else:
-                 data_dict["result"] = self.result
+            data_dict["result"] = _with_iso_timestamp(self.result)
         return data_dict
 
 class Connection:
     """Represents a client connection and its operations."""
+    __slots__ = (
+        'conn_num', 'bind_timestamp', 'unbind_timestamp', 'bind_dn', 'successful_bind',
+        'operations', 'unindexed_searches', 'source_ip', 'destination_ip'
+    )
+
     def __init__(self, conn_num):
         self.conn_num = conn_num
         self.bind_timestamp = None
         self.unbind_timestamp = None
         self.bind_dn = None
         self.successful_bind = False
+        # Operations keyed by op number; logs rotated mid-connection or a reused
+        # connection number can start at any op number and leave gaps.
         self.operations = {}
+        # SRCH operations whose RESULT reported an unindexed filter, in log order
+        self.unindexed_searches = []
         self.source_ip = None
         self.destination_ip = None
 
+    def get_operation(self, op_num):
+        """Returns the operation with the given number, or None if it was not logged."""
+        return self.operations.get(op_num)
+
+    def iter_operations(self):
+        """Yields the logged operations in op number order."""
+        operations = self.operations
+        # Operations are usually added in op number order, so this sort is linear.
+        for op_num in sorted(operations):
+            yield operations[op_num]
+
     def add_operation(self, op_num, op_type, timestamp, data, extra_text):
         """Adds or updates an operation in the connection."""
         # Handle connection info lines, which describe the connection itself.
         if op_type == "CONNECTION_INFO":
-            self.source_ip = data.get('source_ip')
-            self.destination_ip = data.get('destination_ip')
+            source_ip = data.get('source_ip')
+            destination_ip = data.get('destination_ip')
+            self.source_ip = sys.intern(source_ip) if source_ip else None
+            self.destination_ip = sys.intern(destination_ip) if destination_ip else None
             return # This is not an operation, so we just update the connection and return.
 
         # A connection is closed when the parser identifies a 'Disconnect' operation.
@@ -73,20 +122,28 @@ class Connection:
             return
 
         if op_type == "RESULT":
-            if op_num in self.operations:
-                self.operations[op_num].result = data
+            operation = self.get_operation(op_num)
+            if operation is not None:
+                # The parser always returns a dict, so Operation.result is a dict or None.
+                operation.result = data
+                # Record unindexed searches now so queries need not scan every operation
+                if operation.op_type == "SRCH" and data.get('details') == UNINDEXED_SEARCH_DETAILS:
+                    self.unindexed_searches.append(operation)
                 # Check if this is a result for a BIND operation
-                if self.operations[op_num].op_type == "BIND" and isinstance(data, dict) and data.get('err') == 0:
+                if operation.op_type == "BIND" and data.get('err') == 0:
                     self.successful_bind = True
-                    self.bind_timestamp = self.operations[op_num].timestamp
+                    self.bind_timestamp = operation.timestamp
                     # The DN is often in the RESULT of the BIND, not the BIND itself
-                    if isinstance(data, dict) and 'dn' in data:
+                    if 'dn' in data:
+                        _intern_fields(data, INTERNED_FIELDS['BIND'])
                         self.bind_dn = data.get('dn')
-                    elif isinstance(self.operations[op_num].data, dict):
-                        self.bind_dn = self.operations[op_num].data.get('dn')
+                    else:
+                        self.bind_dn = operation.data.get('dn')
         else:
             # Log the BIND, UNBIND, SRCH, etc. operations.
             if op_num not in self.operations:
+                if op_type in INTERNED_FIELDS:
+                    _intern_fields(data, INTERNED_FIELDS[op_type])
                 self.operations[op_num] = Operation(op_num, op_type, timestamp, data, extra_text)
 
 
@@ -99,41 +156,151 @@ class Connection:
             "bind_dn": self.bind_dn,
             "bind_timestamp": self.bind_timestamp.isoformat() if self.bind_timestamp else None,
             "unbind_timestamp": self.unbind_timestamp.isoformat() if self.unbind_timestamp else None,
-            "operations": sorted([op.to_dict() for op in self.operations.values()], key=lambda x: x.get('op_num', 0))
+            "operations": [op.to_dict() for op in self.iter_operations()]
         }
 
-def build_data_model(log_file_path, debug=False):
-    """Parses a log file and builds a structured data model of connections."""
+def iter_connections(log_file_path, debug=False, jobs=1, filter_ips=None):
+    """
+    Parses a log file and yields each Connection once no more lines can belong to it.
+    That is CLOSED_CONNECTION_GRACE_LINES lines after it was closed, or as soon as its
+    connection number is reused by a new 'connection from' line (e.g. after a server
+    restart). Connections that are still open at the end of the log are yielded last.
+    If filter_ips is given, only connections from those source IPs are built.
+    """
+    # Connections that have not seen a Disconnect yet
+    open_connections = {}
+    # Closed connections that may still get late lines, and the order they were
+    # closed in as (line number, conn id, connection) tuples
+    closed_connections = {}
+    closed_order = deque()
+    # Ids of connections that were already yielded or dropped, mapped to the line
+    # number they were retired at. Stray lines for them are ignored for another
+    # CLOSED_CONNECTION_GRACE_LINES lines, after which the id is forgotten.
+    finished_conn_ids = {}
+    finished_order = deque()
+    # Open connections whose source IP did not pass filter_ips; their lines are skipped.
+    dropped_conn_ids = set()
+    line_num = 0
+    # This loop runs once per log line; local names avoid repeated global lookups.
+    new_connection = Connection
+    grace_lines = CLOSED_CONNECTION_GRACE_LINES
 
+    # Only lines with a conn= field are used, so skip the others before parsing them.
+    for parsed in parse_log_file(log_file_path, debug, jobs, must_contain='conn='):
+        get = parsed.get
+        conn_id = get('conn')
+        if conn_id is None:
+            continue
+        line_num += 1
 
-    connections = {}
+        # Yield the closed connections that are past their grace period
+        while closed_order and closed_order[0][0] <= line_num - grace_lines:
+            _, closed_id, conn = closed_order.popleft()
+            if closed_connections.get(closed_id) is conn:
+                del closed_connections[closed_id]
+                finished_conn_ids[closed_id] = line_num
+                finished_order.append((line_num, closed_id))
+                if filter_ips is None or conn.source_ip in filter_ips:
+                    yield conn
+        while finished_order and finished_order[0][0] <= line_num - grace_lines:
+            finished_line, finished_id = finished_order.popleft()
+            if finished_conn_ids.get(finished_id) == finished_line:
+                del finished_conn_ids[finished_id]
 
-    with open(log_file_path, 'r') as f:
-        for line in f:
-            if not line.strip():
-                continue
-            try:
-                parsed = parse_log_line(line.strip())
-            except Exception as e:
-                if debug:
-                    print(f"Failed to parse line: {line.strip()}\n{e}")
-                continue
+        op_type = get('type')
 
-            if not parsed or 'conn' not in parsed:
-                continue
+        if op_type == "CONNECTION_INFO":
+            # A new connection; its number may have been used before in this log.
+            previous = open_connections.pop(conn_id, None) or closed_connections.pop(conn_id, None)
+            if previous is not None and (filter_ips is None or previous.source_ip in filter_ips):
+                yield previous
+            finished_conn_ids.pop(conn_id, None)
+            if filter_ips is not None:
+                # The source IP is known as soon as the connection is opened.
+                if get('source_ip') not in filter_ips:
+                    dropped_conn_ids.add(conn_id)
+                    continue
+                dropped_conn_ids.discard(conn_id)
+        elif filter_ips is not None and conn_id in dropped_conn_ids:
+            if op_type == "Disconnect":
+                # Late lines of the dropped connection are ignored like those of a finished one
+                dropped_conn_ids.discard(conn_id)
+                finished_conn_ids[conn_id] = line_num
+                finished_order.append((line_num, conn_id))
+            continue
 
-            conn_id = parsed.get('conn')
-            op_num = parsed.get('op')
-            op_type = parsed.get('type')
-            timestamp = parsed.get('timestamp')
-            extra_text = parsed.get('extra_text') # This might be None
+        # One lookup for the common case of a connection that is already open
+        conn = open_connections.get(conn_id)
+        if conn is None:
+            # Late lines, e.g. a second 'closed' line, belong to the connection that just closed.
+            conn = closed_connections.get(conn_id)
+            if conn is None:
+                if conn_id in finished_conn_ids:
+                    if debug:
+                        print(f"Ignoring late line for connection {conn_id}, which is already complete: {parsed}",
+                              file=sys.stderr)
+                    continue
+                conn = open_connections[conn_id] = new_connection(conn_id)
 
-            if conn_id not in connections:
-                connections[conn_id] = Connection(conn_id)
+        # Pass the entire parsed dictionary as the 'data' payload
+        conn.add_operation(get('op'), op_type, get('timestamp'), parsed, get('extra_text'))
 
-            # Pass the entire parsed dictionary as the 'data' payload
-            connections[conn_id].add_operation(op_num, op_type, timestamp, parsed, extra_text)
+        if op_type == "Disconnect" and conn_id in open_connections:
+            del open_connections[conn_id]
+            closed_connections[conn_id] = conn
+            closed_order.append((line_num, conn_id, conn))
 
-    return connections
+    for conn in chain(closed_connections.values(), open_connections.values()):
+        # Connections whose opening line is not in the log have no known source IP.
+        if filter_ips is None or conn.source_ip in filter_ips:
+            yield conn
 
+class LogModel(dict):
+    """
+    Maps connection numbers to Connection objects.
+    A connection number can be used by several connections in one log, e.g. after a
+    server restart. The mapping then holds the latest of them, while all_connections
+    lists every connection in the order they were added. The connections with a
+    successful bind are also indexed by whether they were closed, so queries do not
+    have to scan every connection; the indexes are subsets of all_connections.
+    """
+    def __init__(self):
+        super().__init__()
+        self.all_connections = []
+        # Successfully bound connections, in the order they were added
+        self.completed_connections = []
+        self.open_connections = []
+
+    def add(self, conn):
+        """Adds a connection whose state is final, i.e. complete or still open at EOF."""
+        self[conn.conn_num] = conn
+        self.all_connections.append(conn)
+        if conn.successful_bind:
+            if conn.unbind_timestamp is None:
+                self.open_connections.append(conn)
+            elif conn.bind_timestamp is not None:
+                # The src-ip-table prints both timestamps of a completed connection
+                self.completed_connections.append(conn)
+
+def build_data_model(log_file_path, debug=False, jobs=1, filter_ips=None):
+    """Parses a log file and builds a structured data model of connections."""
+    model = LogModel()
+    for conn in iter_connections(log_file_path, debug, jobs, filter_ips):
+        model.add(conn)
+    return model
 
+def write_json(stream, connections):
+    """
+    Writes connections to a text stream as a JSON array.
+    Each connection is encoded and written on its own, so the full document is
+    never built in memory; connections can be any iterable of Connection
+    objects, e.g. the values of a data model or iter_connections().
+    """
+    encode = json.JSONEncoder().encode
+    write = stream.write
+    write('[')
+    for i, conn in enumerate(connections):
+        if i:
+            write(',')
+        write(encode(conn.to_dict()))
+    write(']\n')
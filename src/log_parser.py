@@ -1,9 +1,11 @@
 import argparse
+import multiprocessing
+import os
 import re
+import sys
+from collections import deque
 from datetime import datetime, timezone, timedelta
-
-# Regex to capture the timestamp and the rest of the message from a log line.
-LOG_LINE_RE = re.compile(r'^\[(.*?)\] (.*)$')
+from functools import lru_cache, partial
 
 # Regex to parse the timestamp string into its components.
 # Example: 10/Jun/2025:20:50:45.194508+00:00 or 10/Jun/2025:20:50:45 Z
@@ -13,6 +15,59 @@ TIMESTAMP_RE = re.compile(
     r'\s*([Zz]|[+-]\d{4})$'                          # Timezone (Z, +HHMM, or -HHMM)
 )
 
+# Regex to frame a log line and split its timestamp in a single pass.
+# Groups 1-8 are the TIMESTAMP_RE groups, group 9 is the rest of the message.
+LOG_LINE_RE = re.compile(
+    r'^\[(\d{2})/(\w{3})/(\d{4}):(\d{2}):(\d{2}):(\d{2})'
+    r'(\.\d+)?'
+    r'\s*([Zz]|[+-]\d{4})\] (.*)$'
+)
+
+# Access logs are decoded the same way by the serial reader and the parallel
+# workers. Undecodable bytes (e.g. a latin-1 DN) are replaced so that a single
+# bad line cannot abort the whole run.
+LOG_ENCODING = 'utf-8'
+LOG_ENCODING_ERRORS = 'replace'
+
+# Read buffer for the serial reader. Line iteration stays in C, while large
+# files are read with far fewer read() calls than the 8 KiB default.
+READ_BUFFER_SIZE = 1 << 20
+
+# Number of output lines the log_parser CLI collects before writing them at once.
+PRINT_BATCH_SIZE = 4096
+
+# Upper bound for the byte ranges handed to parallel workers. A worker returns
+# its whole range at once, so logs are split into many more chunks than jobs.
+PARALLEL_CHUNK_SIZE = 4 << 20
+
+# Parallel chunks in flight per worker. Results are collected in file order and
+# no further chunk is submitted until the oldest one was consumed, so the parent
+# holds at most this many chunks per worker however slow the consumer is.
+PARALLEL_CHUNKS_PER_JOB = 2
+
+# Key-value pairs in a log message, where values can be unquoted, quoted, or numeric.
+KV_RE = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|\S+)')
+
+# Informational text describing the endpoints of a new connection.
+CONNECTION_INFO_RE = re.compile(r'connection from (\S+) to (\S+)')
+
+# The plain RESULT line, by far the most common shape in an access log. It is
+# matched in one go; any other RESULT line takes the generic key-value path.
+RESULT_LINE_RE = re.compile(
+    r'conn=(\d+) op=(-?\d+) RESULT err=(\d+) tag=(\d+) nentries=(\d+)'
+    r' wtime=(\d+\.\d+) optime=(\d+\.\d+) etime=(\d+\.\d+)$'
+)
+
+# Operation types recognised as the first word of a message.
+OPERATION_TYPES = frozenset({"BIND", "RESULT", "SRCH", "UNBIND", "EXT", "Disconnect", "ADD", "DEL"})
+
+# Keys whose values are never integers, such as DNs and filters. The integer
+# coercion skips them instead of failing on every line.
+STRING_KEYS = frozenset({
+    'type', 'extra_text', 'source_ip', 'destination_ip', 'dn', 'base', 'filter',
+    'attrs', 'mech', 'oid', 'name', 'notes', 'details',
+})
+
 MONTH_MAP = {
     'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
     'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
@@ -23,65 +78,82 @@ def parse_timestamp(ts_str):
     match = TIMESTAMP_RE.match(ts_str)
     if not match:
         return None
+    return _build_timestamp(*match.groups())
 
-    day, month_str, year, hour, minute, second, fractional, tz_str = match.groups()
+def _build_timestamp(day, month_str, year, hour, minute, second, fractional, tz_str):
+    """Builds a timezone-aware datetime from the groups of TIMESTAMP_RE."""
+    dt = _whole_second_timestamp(day, month_str, year, hour, minute, second, tz_str)
+    if dt is None or not fractional:
+        return dt
+    # The fractional part includes the dot, e.g., ".123456"
+    # Truncate or pad to 6 digits for microseconds.
+    sec_frac_str = fractional[1:7]
+    return dt.replace(microsecond=int(sec_frac_str.ljust(6, '0')))
 
+# Busy servers log many lines per second, so the whole-second part of a
+# timestamp repeats and only the fraction has to be applied per line.
+@lru_cache(maxsize=8192)
+def _whole_second_timestamp(day, month_str, year, hour, minute, second, tz_str):
+    """Builds the timezone-aware datetime of a timestamp without its fractional seconds."""
     month = MONTH_MAP.get(month_str.capitalize())
     if not month:
         return None
+    return datetime(int(year), month, int(day), int(hour), int(minute), int(second),
+                    tzinfo=_parse_timezone(tz_str))
 
-    microsecond = 0
-    if fractional:
-        # The fractional part includes the dot, e.g., ".123456"
-        # Truncate or pad to 6 digits for microseconds.
-        sec_frac_str = fractional[1:7]
-        microsecond = int(sec_frac_str.ljust(6, '0'))
-
-    dt = datetime(int(year), month, int(day), int(hour), int(minute), int(second), microsecond)
+# tzinfo objects by their offset string; a log only ever uses a few offsets.
+_TIMEZONES = {}
 
-    if tz_str:
-        if tz_str.upper() == 'Z':
-            dt = dt.replace(tzinfo=timezone.utc)
+def _parse_timezone(tz_str):
+    """Returns the tzinfo for a 'Z', '+HHMM' or '-HHMM' offset string."""
+    tz = _TIMEZONES.get(tz_str)
+    if tz is None:
+        if not tz_str or tz_str.upper() == 'Z':
+            # Default to UTC if no timezone is specified.
+            tz = timezone.utc
         else:
             offset_hours = int(tz_str[1:3])
             offset_minutes = int(tz_str[3:5])
             offset_sign = -1 if tz_str[0] == '-' else 1
             offset = timedelta(hours=offset_hours, minutes=offset_minutes) * offset_sign
-            dt = dt.replace(tzinfo=timezone(offset))
-    else:
-        # Default to UTC if no timezone is specified.
-        dt = dt.replace(tzinfo=timezone.utc)
-    
-    return dt
+            tz = timezone(offset)
+        _TIMEZONES[tz_str] = tz
+    return tz
 
 def parse_key_value_message(message):
     """
     Parses a message string for key-value pairs, operation type, and extra text.
     It robustly handles logs where the operation type is mixed with key-value pairs.
     """
-    # This regex is the core of the message parsing.
-    # It finds key-value pairs, where values can be unquoted, quoted, or numeric.
-    kv_pattern = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|\S+)')
-    data = {}
-    
-    # Find all k-v pairs and the text that is NOT a k-v pair
-    last_end = 0
-    non_kv_parts = []
-    for match in kv_pattern.finditer(message):
-        # Text before this match is a non-kv part
-        non_kv_parts.append(message[last_end:match.start()])
-        
-        key = match.group(1)
-        value = match.group(2)
-        # Strip quotes from quoted values
-        if value.startswith('"') and value.endswith('"'):
-            value = value[1:-1]
-
-        data[key] = value
-        last_end = match.end()
-    
-    # Append any remaining text after the last k-v pair
-    non_kv_parts.append(message[last_end:])
+    match = RESULT_LINE_RE.match(message)
+    if match:
+        # Same result as the generic path below: integers converted, times kept as strings.
+        conn, op, err, tag, nentries, wtime, optime, etime = match.groups()
+        return {
+            'conn': int(conn), 'op': int(op), 'err': int(err), 'tag': int(tag),
+            'nentries': int(nentries), 'wtime': wtime, 'optime': optime, 'etime': etime,
+            'type': 'RESULT',
+        }
+
+    # A single split() scans the whole message in C. The result alternates the
+    # text that is NOT a k-v pair with each pair's key and value:
+    # [text, key, value, text, key, value, ..., text]
+    parts = KV_RE.split(message)
+    non_kv_parts = parts[0::3]
+    data = dict(zip(parts[1::3], parts[2::3]))
+
+    # Strip quotes and convert numeric-like strings to integers in one pass.
+    quoted = '"' in message
+    for key, value in data.items():
+        # Values are never empty. An unterminated '"abc' is an unquoted value, so check both ends.
+        if quoted and value[0] == '"' == value[-1]:
+            value = data[key] = value[1:-1]
+        if key in STRING_KEYS:
+            continue
+        if value.isdigit():
+            data[key] = int(value)
+        elif value.startswith('-') and value[1:].isdigit():
+            data[key] = int(value)
     
     # Join the non-k-v parts and clean them up. This is our "extra text".
     extra_text = " ".join(non_kv_parts).strip()
@@ -99,14 +171,17 @@ def parse_key_value_message(message):
         if op_type == "closed":
             op_type = "Disconnect"
 
-        if op_type in ["BIND", "RESULT", "SRCH", "UNBIND", "EXT", "Disconnect", "ADD", "DEL"]:
+        if op_type in OPERATION_TYPES:
             data['type'] = op_type
             # The rest of the text is stored as extra_text
             if len(parts) > 1:
                 data['extra_text'] = parts[1].lstrip('- ')
         else:
-            # Not a known op_type, check for special informational text patterns
-            conn_info_match = re.search(r'connection from (\S+) to (\S+)', extra_text)
+            # Not a known op_type, check for special informational text patterns.
+            # The substring test is cheaper than running the regex on every INFO line.
+            conn_info_match = None
+            if 'connection from' in extra_text:
+                conn_info_match = CONNECTION_INFO_RE.search(extra_text)
             if conn_info_match:
                 data['type'] = 'CONNECTION_INFO'
                 data['source_ip'] = conn_info_match.group(1)
@@ -123,14 +198,6 @@ def parse_key_value_message(message):
              data['type'] = 'RESULT'
         else:
              data['type'] = 'INFO'
-        
-    # Try to convert numeric-like strings to integers.
-    for key, value in data.items():
-        if isinstance(value, str):
-            if value.isdigit():
-                data[key] = int(value)
-            elif value.startswith('-') and value[1:].isdigit():
-                data[key] = int(value)
 
     return data
 
@@ -143,44 +210,177 @@ def parse_log_line(line):
     if not match:
         return None
 
-    timestamp_str, message_str = match.groups()
-
-    timestamp = parse_timestamp(timestamp_str)
+    timestamp = _build_timestamp(*match.group(1, 2, 3, 4, 5, 6, 7, 8))
     if not timestamp:
         return None # Failed to parse timestamp
 
-    parsed_message = parse_key_value_message(message_str)
+    parsed_message = parse_key_value_message(match.group(9))
     parsed_message['timestamp'] = timestamp
     
     return parsed_message
 
+def _parse_lines(lines, debug=False, must_contain=None):
+    """
+    Parses an iterable of raw lines, skipping blank and unparsable ones.
+    If must_contain is given, lines without that substring are skipped unparsed.
+    """
+    parse = parse_log_line
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if must_contain is not None and must_contain not in line:
+            continue
+        try:
+            parsed = parse(line)
+        except Exception as e:
+            if debug:
+                print(f"Failed to parse line: {line}\n{e}", file=sys.stderr)
+            continue
+        if parsed:
+            yield parsed
+
+def _advise_sequential(f, offset=0, length=0):
+    """
+    Tells the kernel that a byte range of an open file (by default all of it) will be
+    read sequentially, so it reads ahead more aggressively. A no-op where unsupported.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+def find_chunk_boundaries(log_file_path, num_chunks):
+    """
+    Splits a log file into up to num_chunks (start, end) byte ranges.
+    Every range starts at the beginning of a line and ends after a newline (or at EOF).
+    """
+    size = os.path.getsize(log_file_path)
+    offsets = [0]
+    with open(log_file_path, 'rb') as f:
+        for i in range(1, num_chunks):
+            f.seek(size * i // num_chunks)
+            f.readline() # Skip to the start of the next line
+            offset = f.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+def _read_chunk_lines(log_file_path, byte_range):
+    """Reads a (start, end) byte range of a log file and returns its decoded lines."""
+    start, end = byte_range
+    with open(log_file_path, 'rb') as f:
+        _advise_sequential(f, start, end - start)
+        f.seek(start)
+        data = f.read(end - start)
+    return data.decode(LOG_ENCODING, LOG_ENCODING_ERRORS).split('\n')
+
+def _map_chunks(log_file_path, jobs, chunk_func):
+    """
+    Splits a log file into line-aligned chunks of at most about PARALLEL_CHUNK_SIZE
+    bytes, calls chunk_func(log_file_path, byte_range) for each of them in up to
+    jobs worker processes and yields the items of the returned lists in file order.
+    At most PARALLEL_CHUNKS_PER_JOB chunks per worker are in flight at a time.
+    """
+    size = os.path.getsize(log_file_path)
+    chunks = find_chunk_boundaries(log_file_path, max(jobs, -(-size // PARALLEL_CHUNK_SIZE)))
+    jobs = min(jobs, len(chunks))
+    chunk_func = partial(chunk_func, log_file_path)
+    with multiprocessing.Pool(jobs) as pool:
+        # Unlike imap, a bounded window of tasks cannot run ahead of the consumer.
+        # Results are plain dicts and strings, which pickle cheaply.
+        pending = deque()
+        for byte_range in chunks:
+            pending.append(pool.apply_async(chunk_func, (byte_range,)))
+            if len(pending) >= jobs * PARALLEL_CHUNKS_PER_JOB:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+def parse_log_chunk(log_file_path, byte_range, debug=False, must_contain=None):
+    """Parses the lines in a (start, end) byte range of a log file and returns them as a list."""
+    return list(_parse_lines(_read_chunk_lines(log_file_path, byte_range), debug, must_contain))
+
+def parse_log_file(log_file_path, debug=False, jobs=1, must_contain=None):
+    """
+    Parses a log file and yields the parsed lines in file order.
+    If must_contain is given, only lines containing that substring are parsed.
+    With jobs > 1 the file is split into line-aligned chunks of at most about
+    PARALLEL_CHUNK_SIZE bytes that are parsed in worker processes, which
+    sidesteps the GIL for this CPU-bound work. Pipes and other files that
+    cannot be split by offset are always read serially.
+    """
+    if jobs <= 1 or not os.path.isfile(log_file_path):
+        with open(log_file_path, 'r', buffering=READ_BUFFER_SIZE,
+                  encoding=LOG_ENCODING, errors=LOG_ENCODING_ERRORS) as f:
+            _advise_sequential(f)
+            yield from _parse_lines(f, debug, must_contain)
+        return
+
+    yield from _map_chunks(log_file_path, jobs, partial(parse_log_chunk, debug=debug, must_contain=must_contain))
+
+def _format_lines(lines):
+    """Yields the output of the log_parser CLI for each raw line: the parsed dict or an error."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            parsed = parse_log_line(line)
+            if parsed:
+                yield str(parsed)
+        except Exception as e:
+            yield f"Error parsing line: {line}\n{e}"
+
+def _format_log_chunk(log_file_path, byte_range):
+    """Returns the log_parser CLI output for the lines in a (start, end) byte range of a log file."""
+    return list(_format_lines(_read_chunk_lines(log_file_path, byte_range)))
+
+def _write_batched(outputs):
+    """Writes outputs to stdout as lines, PRINT_BATCH_SIZE at a time instead of one print() each."""
+    write = sys.stdout.write
+    batch = []
+    try:
+        for output in outputs:
+            batch.append(output)
+            if len(batch) >= PRINT_BATCH_SIZE:
+                write("\n".join(batch) + "\n")
+                batch.clear()
+    finally:
+        # Also write what was collected if parsing stops early, e.g. on Ctrl-C
+        if batch:
+            write("\n".join(batch) + "\n")
+
+def positive_int(value):
+    """Parses a command line value as an integer greater than zero."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value!r}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(description="Parse 389-ds access logs.")
     parser.add_argument("-f", "--file", help="Path to the log file to parse.")
     parser.add_argument("-l", "--line", help="A single log line to parse.")
+    parser.add_argument("-j", "--jobs", type=positive_int, default=1,
+                        help="Number of worker processes used to parse the file (default: 1).")
     args = parser.parse_args()
 
-    if args.file:
-        with open(args.file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    parsed = parse_log_line(line)
-                    if parsed:
-                        print(parsed)
-                except Exception as e:
-                    print(f"Error parsing line: {line}\n{e}")
+    if args.file and args.jobs > 1 and os.path.isfile(args.file):
+        # Workers format their chunks; the output keeps the order of the file.
+        _write_batched(_map_chunks(args.file, args.jobs, _format_log_chunk))
+    elif args.file:
+        with open(args.file, 'r', buffering=READ_BUFFER_SIZE,
+                  encoding=LOG_ENCODING, errors=LOG_ENCODING_ERRORS) as f:
+            _advise_sequential(f)
+            _write_batched(_format_lines(f))
     elif args.line:
-        line = args.line.strip()
-        if line:
-            try:
-                parsed = parse_log_line(line)
-                if parsed:
-                    print(parsed)
-            except Exception as e:
-                print(f"Error parsing line: {line}\n{e}")
+        _write_batched(_format_lines([args.line]))
 
 if __name__ == "__main__":
     main()
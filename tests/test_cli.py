@@ -1,24 +1,38 @@
+import asyncio
 import io
+import json
 import os
 import socket
 import subprocess
 import sys
+import time
 import pytest
 from contextlib import redirect_stdout
-from unittest.mock import patch
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
-from cli import print_unique_clients
+import cli
+import data_model
+from data_model import Connection, LogModel
+from cli import (
+    load_hostname_cache,
+    prewarm_hostnames,
+    print_unique_clients,
+    resolve_hostnames_batch,
+    save_hostname_cache,
+)
 
 # Path to the log file used for testing
 LOG_FILE = "test-files/access-comprehensive.log"
 
-def run_command(command, check=True):
+def run_command(command, check=True, input=None):
     """Helper function to run a command and return the result."""
     # Ensure the project root is in the python path for subprocesses so `src.` imports work
     env = os.environ.copy()
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     env['PYTHONPATH'] = project_root + os.pathsep + env.get('PYTHONPATH', '')
-    return subprocess.run(command, capture_output=True, text=True, check=check, env=env)
+    return subprocess.run(command, capture_output=True, text=True, check=check, env=env, input=input)
 
 def test_src_ip_table_subcommand():
     """Tests the 'src-ip-table' subcommand."""
@@ -54,6 +68,13 @@ def test_unindexed_searches_subcommand():
     assert "Timestamp                           Conn       Op         Base" in result.stdout
     assert "(&(objectClass=ipHost)(ipHostNumber=10.31.50.48))" in result.stdout
 
+def test_json_subcommand():
+    """Tests that the 'json' subcommand writes every connection as a JSON array."""
+    command = [sys.executable, "-m", "cli", "json", "-f", LOG_FILE]
+    connections = json.loads(run_command(command).stdout)
+    assert [c["connection_num"] for c in connections] == [100, 101, 103, 102, 104, 105]
+    assert connections[0]["operations"][0]["type"] == "BIND"
+
 def test_filter_client_ip():
     """Tests the '--filter-client-ip' argument."""
     command = [
@@ -66,6 +87,87 @@ def test_filter_client_ip():
     assert "192.168.1.11" in result.stdout
     assert "192.168.1.10" not in result.stdout
 
+def test_limit_option():
+    """Tests that '--limit' keeps only the earliest rows of a table."""
+    command = [sys.executable, "-m", "cli", "src-ip-table", "-f", LOG_FILE]
+    full = run_command(command).stdout.splitlines()
+    limited = run_command(command + ["--limit", "1"]).stdout.splitlines()
+    assert len(full) > 3
+    assert limited == full[:3]
+
+def test_limit_option_rejects_non_positive():
+    """Tests that '--limit' must be a positive integer."""
+    for value in ("0", "-1", "x"):
+        result = run_command([sys.executable, "-m", "cli", "src-ip-table", "-f", LOG_FILE, "--limit", value], check=False)
+        assert result.returncode == 2
+        assert "--limit: must be a positive integer" in result.stderr
+
+def test_also_option():
+    """Tests that '--also' prints further queries from a single parse."""
+    command = [
+        sys.executable, "-m", "cli",
+        "src-ip-table",
+        "-f", LOG_FILE,
+        "--also", "unique-clients", "src-ip-table"
+    ]
+    result = run_command(command)
+    assert result.stdout.count("Source IP            Bind Timestamp") == 1
+    assert "\n\nUnique Client IPs\n" in result.stdout
+    assert result.stdout.index("Source IP") < result.stdout.index("Unique Client IPs")
+
+def test_also_rejects_json():
+    """Tests that JSON output cannot be mixed with tables on stdout."""
+    for args in (["json", "-f", LOG_FILE, "--also", "src-ip-table"],
+                 ["src-ip-table", "-f", LOG_FILE, "--also", "json"]):
+        result = run_command([sys.executable, "-m", "cli"] + args, check=False)
+        assert result.returncode == 2
+        assert result.stdout == ""
+
+def test_json_rejects_table_options():
+    """Tests that json refuses the options that only apply to the tables."""
+    for option in (["--limit", "1"], ["--resolve-hostnames"]):
+        result = run_command([sys.executable, "-m", "cli", "json", "-f", LOG_FILE] + option, check=False)
+        assert result.returncode == 2
+        assert f"json cannot be combined with {option[0]}" in result.stderr
+
+def test_json_debug_output_goes_to_stderr(tmp_path, monkeypatch, capsys):
+    """Tests that --debug messages do not end up in the JSON document."""
+    log_file = tmp_path / "access"
+    log_file.write_text(
+        "[10/Jun/2025:10:00:00.000000 +0000] conn=1 fd=64 slot=64 connection from 10.0.0.1 to 10.0.0.9\n"
+        "[10/Jun/2025:10:00:01.000000 +0000] conn=1 op=-1 fd=64 Disconnect - B1\n"
+        "[10/Jun/2025:10:00:02.000000 +0000] conn=2 fd=65 slot=65 connection from 10.0.0.2 to 10.0.0.9\n"
+        "[10/Jun/2025:10:00:03.000000 +0000] conn=1 op=-1 fd=64 Disconnect - B1\n"
+    )
+    monkeypatch.setattr(data_model, "CLOSED_CONNECTION_GRACE_LINES", 2)
+    monkeypatch.setattr(sys, "argv", ["cli", "json", "-f", str(log_file), "--debug"])
+    cli.main()
+    captured = capsys.readouterr()
+    assert [conn["source_ip"] for conn in json.loads(captured.out)] == ["10.0.0.1", "10.0.0.2"]
+    assert "Ignoring late line for connection 1" in captured.err
+
+def test_jobs_option():
+    """Tests that parsing with several worker processes gives the same output."""
+    command = [sys.executable, "-m", "cli", "src-ip-table", "-f", LOG_FILE]
+    serial = run_command(command)
+    parallel = run_command(command + ["--jobs", "2"])
+    assert parallel.stdout == serial.stdout
+
+def test_jobs_option_reads_pipes_serially():
+    """Tests that '--jobs' falls back to the serial reader for input that cannot be split."""
+    with open(LOG_FILE) as f:
+        log = f.read()
+    serial = run_command([sys.executable, "-m", "cli", "src-ip-table", "-f", LOG_FILE])
+    piped = run_command([sys.executable, "-m", "cli", "src-ip-table", "-f", "/dev/stdin", "--jobs", "2"], input=log)
+    assert piped.stdout == serial.stdout
+
+def test_jobs_option_rejects_non_positive():
+    """Tests that '--jobs' must be a positive integer."""
+    for value in ("0", "-2"):
+        result = run_command([sys.executable, "-m", "cli", "src-ip-table", "-f", LOG_FILE, "--jobs", value], check=False)
+        assert result.returncode == 2
+        assert "--jobs: must be a positive integer" in result.stderr
+
 def test_hostname_resolution():
     """Tests that hostname resolution works correctly as a unit test."""
     # Create a dummy Connection object to simulate the data model
@@ -78,8 +180,8 @@ def test_hostname_resolution():
         2: MockConnection("192.168.1.11"),
     }
 
-    # Mock the socket call to simulate DNS lookups
-    with patch('cli.socket.gethostbyaddr') as mock_gethostbyaddr:
+    # Mock the socket call to simulate DNS lookups (the thread-pool path, without aiodns)
+    with patch('cli.aiodns', None), patch('cli.socket.gethostbyaddr') as mock_gethostbyaddr:
         # Return a different hostname depending on the IP looked up
         def side_effect(ip):
             if ip == "192.168.1.10":
@@ -99,6 +201,91 @@ def test_hostname_resolution():
     assert "host2.example.com" in output
     assert "192.168.1.10" not in output
 
+def test_tables_accept_plain_dict():
+    """Tests that the tables also work on a plain dict of connections."""
+    model = cli.build_data_model(LOG_FILE)
+    for print_table in (cli.print_src_ip_table, cli.print_open_connections_table):
+        expected, actual = io.StringIO(), io.StringIO()
+        with redirect_stdout(expected):
+            print_table(model)
+        with redirect_stdout(actual):
+            print_table(dict(model))
+        assert actual.getvalue() == expected.getvalue()
+
+def test_src_ip_table_skips_connections_without_bind_timestamp():
+    """Tests that a closed connection whose BIND had no timestamp is not printed."""
+    conn = Connection(1)
+    conn.add_operation(0, "BIND", None, {"dn": "cn=a"}, None)
+    conn.add_operation(0, "RESULT", None, {"err": 0}, None)
+    conn.add_operation(-1, "Disconnect", datetime(2025, 6, 10, tzinfo=timezone.utc), {}, None)
+    model = LogModel()
+    model.add(conn)
+    for connections in ({1: conn}, model):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            cli.print_src_ip_table(connections)
+        assert len(output.getvalue().splitlines()) == 2
+
+def test_prewarm_hostnames():
+    """Tests that pre-resolving fills the cache for every distinct IP."""
+    with patch('cli.aiodns', None), patch('cli.socket.gethostbyaddr') as mock_gethostbyaddr, \
+            patch.dict(cli.hostname_cache, clear=True):
+        def side_effect(ip):
+            if ip == "10.0.0.1":
+                return ("a.example.com", [], [ip])
+            raise socket.herror("Not found")
+        mock_gethostbyaddr.side_effect = side_effect
+
+        prewarm_hostnames(["10.0.0.1", "10.0.0.2", "10.0.0.1"])
+
+        assert cli.hostname_cache == {"10.0.0.1": "a.example.com", "10.0.0.2": "10.0.0.2"}
+        assert mock_gethostbyaddr.call_count == 2
+
+def test_resolve_hostnames_batch():
+    """Tests the aiodns batch resolver with a mocked resolver."""
+    async def gethostbyaddr(ip):
+        if ip == "10.0.0.3":
+            return SimpleNamespace(name="c.example.com")
+        raise ValueError("invalid IP address")
+
+    mock_aiodns = MagicMock()
+    mock_aiodns.error.DNSError = OSError
+    mock_aiodns.DNSResolver.return_value.gethostbyaddr.side_effect = gethostbyaddr
+
+    with patch('cli.aiodns', mock_aiodns), patch.dict(cli.hostname_cache, clear=True):
+        asyncio.run(resolve_hostnames_batch(["10.0.0.3", "10.0.0.4"]))
+        assert cli.hostname_cache == {"10.0.0.3": "c.example.com", "10.0.0.4": "10.0.0.4"}
+
+def test_prewarm_hostnames_uses_aiodns_for_printed_rows():
+    """Tests that with aiodns only the IPs of the printed rows are resolved."""
+    model = cli.build_data_model(LOG_FILE)
+    with patch('cli.resolve_hostnames_batch', MagicMock()) as mock_batch, patch('cli.asyncio.run') as mock_run, \
+            patch('cli.aiodns', MagicMock()), patch.dict(cli.hostname_cache, clear=True), \
+            redirect_stdout(io.StringIO()):
+        cli.print_unindexed_searches_table(model)
+        assert not mock_run.called
+        cli.print_src_ip_table(model, resolve_hostnames=True, limit=2)
+        mock_batch.assert_called_once_with({"192.168.1.10", "192.168.1.11"})
+
+def test_hostname_cache_persistence(tmp_path):
+    """Tests that successful lookups survive a save/load round trip and expire after the TTL."""
+    cache_file = tmp_path / "ptr.json"
+    with patch.dict(cli.hostname_cache, clear=True), patch.dict(cli.hostname_cache_resolved_at, clear=True):
+        cli.hostname_cache.update({"10.0.0.5": "e.example.com", "10.0.0.6": "10.0.0.6"})
+        save_hostname_cache(str(cache_file))
+
+    entries = json.loads(cache_file.read_text())
+    assert list(entries) == ["10.0.0.5"]
+
+    entries["10.0.0.7"] = ["old.example.com", time.time() - cli.HOSTNAME_CACHE_TTL - 1]
+    # A damaged entry without a hostname is skipped
+    entries["10.0.0.8"] = [None, time.time()]
+    cache_file.write_text(json.dumps(entries))
+
+    with patch.dict(cli.hostname_cache, clear=True), patch.dict(cli.hostname_cache_resolved_at, clear=True):
+        load_hostname_cache(str(cache_file))
+        assert cli.hostname_cache == {"10.0.0.5": "e.example.com"}
+
 @pytest.mark.parametrize("script_name", [
     "389ds-src-ip-table",
     "389ds-open-connections",
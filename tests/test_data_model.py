@@ -1,7 +1,10 @@
+import io
+import json
 import pytest
 from datetime import datetime, timezone
 import os
-from data_model import build_data_model
+import data_model
+from data_model import Connection, build_data_model, iter_connections, write_json
 
 @pytest.fixture
 def model():
@@ -21,7 +24,165 @@ def test_build_data_model_connections(model):
 def test_build_data_model_operations(model):
     """Tests that operations are added to the connection correctly."""
     conn = model[100]
-    assert len(conn.operations) == 2
-    assert conn.operations[0].op_type == "BIND"
-    assert conn.operations[1].op_type == "SRCH"
-    assert conn.operations[1].result['err'] == 0
+    assert [op.op_type for op in conn.iter_operations()] == ["BIND", "SRCH"]
+    assert conn.get_operation(1).result['err'] == 0
+
+def test_iter_connections_yields_closed_connections_first():
+    """Tests that closed connections are streamed before the ones still open at EOF."""
+    log_file = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test-files', 'access-comprehensive.log'))
+    conns = list(iter_connections(log_file))
+    closed = [c.conn_num for c in conns if c.unbind_timestamp]
+    assert closed == [100, 101, 103]
+    assert [c.conn_num for c in conns[:3]] == closed
+
+DOUBLE_CLOSE_LOG = """\
+[10/Jun/2025:10:00:00.000000 +0000] conn=1 fd=64 slot=64 connection from 10.0.0.1 to 10.0.0.9
+[10/Jun/2025:10:00:01.000000 +0000] conn=1 op=0 BIND dn="cn=a" method=128 version=3
+[10/Jun/2025:10:00:01.100000 +0000] conn=1 op=0 RESULT err=0 tag=97 nentries=0 etime=0.1
+[10/Jun/2025:10:00:02.000000 +0000] conn=1 op=1 SRCH base="dc=example,dc=com" scope=2 filter="(uid=a)" attrs=ALL
+[10/Jun/2025:10:00:02.100000 +0000] conn=1 op=1 RESULT err=0 tag=101 nentries=1 etime=0.1 notes=U details="Partially Unindexed Filter"
+[10/Jun/2025:10:00:03.000000 +0000] conn=1 op=2 UNBIND
+[10/Jun/2025:10:00:03.100000 +0000] conn=1 op=2 fd=64 closed - U1
+[10/Jun/2025:10:00:03.200000 +0000] conn=1 op=-1 fd=64 Disconnect - B1
+"""
+
+STRAY_LINE = "[10/Jun/2025:10:00:09.000000 +0000] conn=1 op=-1 fd=64 Disconnect - B1\n"
+
+REUSED_CONN_LOG = """\
+[10/Jun/2025:10:00:00.000000 +0000] conn=1 fd=64 slot=64 connection from 10.0.0.1 to 10.0.0.9
+[10/Jun/2025:10:00:01.000000 +0000] conn=1 op=0 BIND dn="cn=a" method=128 version=3
+[10/Jun/2025:10:00:01.100000 +0000] conn=1 op=0 RESULT err=0 tag=97 nentries=0 etime=0.1
+[10/Jun/2025:11:00:00.000000 +0000] conn=1 fd=64 slot=64 connection from 10.0.0.2 to 10.0.0.9
+[10/Jun/2025:11:00:01.000000 +0000] conn=1 op=0 BIND dn="cn=b" method=128 version=3
+[10/Jun/2025:11:00:01.100000 +0000] conn=1 op=0 RESULT err=0 tag=97 nentries=0 etime=0.1
+[10/Jun/2025:11:00:02.000000 +0000] conn=1 op=1 UNBIND
+[10/Jun/2025:11:00:02.100000 +0000] conn=1 op=1 fd=64 closed - U1
+"""
+
+def test_iter_connections_attaches_late_lines_to_closed_connection(tmp_path):
+    """Tests that a second close line does not start a new connection."""
+    log_file = tmp_path / "access"
+    log_file.write_text(DOUBLE_CLOSE_LOG)
+    conns = list(iter_connections(str(log_file)))
+    assert len(conns) == 1
+    assert conns[0].source_ip == "10.0.0.1"
+    assert [op.op_num for op in conns[0].unindexed_searches] == [1]
+    assert conns[0].unbind_timestamp == datetime(2025, 6, 10, 10, 0, 3, 200000, tzinfo=timezone.utc)
+
+def test_iter_connections_splits_reused_connection_numbers(tmp_path):
+    """Tests that a reused connection number starts a new connection."""
+    log_file = tmp_path / "access"
+    log_file.write_text(REUSED_CONN_LOG)
+    conns = list(iter_connections(str(log_file)))
+    assert [(c.conn_num, c.source_ip, c.bind_dn) for c in conns] == [(1, "10.0.0.1", "cn=a"), (1, "10.0.0.2", "cn=b")]
+    assert conns[0].unbind_timestamp is None
+    assert conns[1].unbind_timestamp is not None
+    filtered = list(iter_connections(str(log_file), filter_ips=frozenset({"10.0.0.1"})))
+    assert [c.bind_dn for c in filtered] == ["cn=a"]
+
+def test_iter_connections_streams_after_grace_period(tmp_path, monkeypatch):
+    """Tests that closed connections are yielded before EOF once their grace period ends."""
+    monkeypatch.setattr(data_model, "CLOSED_CONNECTION_GRACE_LINES", 6)
+    log_file = tmp_path / "access"
+    log_file.write_text(DOUBLE_CLOSE_LOG + DOUBLE_CLOSE_LOG.replace("conn=1 ", "conn=2 ") + STRAY_LINE)
+    conns = list(iter_connections(str(log_file)))
+    assert [c.conn_num for c in conns] == [1, 2]
+    # Connection 1 was complete before the stray line, which is ignored
+    assert conns[0].unbind_timestamp.second == 3
+
+def test_iter_connections_forgets_finished_connections(tmp_path, monkeypatch):
+    """Tests that the ids of finished and dropped connections are not kept until EOF."""
+    monkeypatch.setattr(data_model, "CLOSED_CONNECTION_GRACE_LINES", 2)
+    log_file = tmp_path / "access"
+    log_file.write_text(DOUBLE_CLOSE_LOG + DOUBLE_CLOSE_LOG.replace("conn=1 ", "conn=2 ") + STRAY_LINE)
+    conns = list(iter_connections(str(log_file)))
+    # Two grace periods after connection 1 closed, a stray line starts a new connection
+    assert [(c.conn_num, c.source_ip) for c in conns] == [(1, "10.0.0.1"), (2, "10.0.0.1"), (1, None)]
+
+    # A connection dropped by the filter is also forgotten once it is closed
+    second_conn = DOUBLE_CLOSE_LOG.replace("conn=1 ", "conn=2 ").replace("10.0.0.1", "10.0.0.2")
+    log_file.write_text(DOUBLE_CLOSE_LOG + second_conn)
+    connections = iter_connections(str(log_file), filter_ips=frozenset({"10.0.0.2"}))
+    assert next(connections).source_ip == "10.0.0.2"
+    state = connections.gi_frame.f_locals
+    assert state["dropped_conn_ids"] == set()
+    assert state["finished_conn_ids"] == {}
+
+def test_operations_start_at_first_seen_op_number():
+    """Tests that a connection first seen mid-log does not pad operations from op 0."""
+    ts = datetime(2025, 6, 10, 21, 18, 6, tzinfo=timezone.utc)
+    conn = Connection(7)
+    conn.add_operation(5000000, "SRCH", ts, {'base': 'dc=example,dc=com'}, None)
+    conn.add_operation(4999999, "BIND", ts, {'dn': 'cn=test'}, None)
+    conn.add_operation(4999999, "RESULT", ts, {'err': 0}, None)
+    assert [op.op_num for op in conn.iter_operations()] == [4999999, 5000000]
+    assert conn.get_operation(4999999).op_type == "BIND"
+    assert conn.get_operation(5000000).op_type == "SRCH"
+    assert conn.get_operation(0) is None
+    assert conn.successful_bind
+
+def test_operations_bound_op_number_gaps():
+    """Tests that operations far apart in op number are all kept and listed in order."""
+    ts = datetime(2025, 6, 10, 21, 18, 6, tzinfo=timezone.utc)
+    conn = Connection(1)
+    conn.add_operation(3000000, "SRCH", ts, {'base': 'dc=example,dc=com'}, None)
+    conn.add_operation(0, "BIND", ts, {'dn': 'cn=test'}, None)
+    conn.add_operation(0, "RESULT", ts, {'err': 0}, None)
+    conn.add_operation(6000000, "UNBIND", ts, {}, None)
+    assert [op.op_num for op in conn.iter_operations()] == [0, 3000000, 6000000]
+    assert conn.get_operation(0).op_type == "BIND"
+    assert conn.get_operation(3000000).op_type == "SRCH"
+    assert conn.get_operation(1) is None
+    assert conn.successful_bind
+    assert [op['op_num'] for op in conn.to_dict()['operations']] == [0, 3000000, 6000000]
+
+def test_build_data_model_tolerates_undecodable_bytes(tmp_path):
+    """Tests that a line with non-UTF-8 bytes does not abort parsing."""
+    log_file = tmp_path / "access"
+    log_file.write_bytes(
+        b'[10/Jun/2025:21:18:06.100000Z] conn=1 op=0 BIND dn="cn=J\xfcrgen" method=128 version=3\n'
+        b'[10/Jun/2025:21:18:06.200000Z] conn=1 op=0 RESULT err=0 tag=97 nentries=0 etime=0.1\n'
+    )
+    model = build_data_model(str(log_file))
+    assert model[1].bind_dn == "cn=J\ufffdrgen"
+
+def test_build_data_model_filter_ips():
+    """Tests that only connections from the requested source IPs are built."""
+    log_file = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test-files', 'access-comprehensive.log'))
+    model = build_data_model(log_file, filter_ips=frozenset({"192.168.1.11", "192.168.1.12"}))
+    assert sorted(model) == [101, 102]
+    assert [op.op_type for op in model[101].iter_operations()] == ["BIND", "ADD", "DEL"]
+
+def test_write_json(model):
+    """Tests that the streamed JSON matches the connections' to_dict() output."""
+    stream = io.StringIO()
+    write_json(stream, model.values())
+    assert json.loads(stream.getvalue()) == [conn.to_dict() for conn in model.values()]
+
+def test_to_dict_does_not_share_payloads():
+    """Tests that changing to_dict() output leaves the model untouched."""
+    conn = Connection(1)
+    conn.add_operation(0, "BIND", None, {"dn": "cn=a"}, None)
+    conn.add_operation(0, "RESULT", None, {"err": 0}, None)
+    op_dict = conn.to_dict()["operations"][0]
+    op_dict["data"]["dn"] = "cn=changed"
+    op_dict["result"]["err"] = 49
+    assert conn.get_operation(0).data == {"dn": "cn=a"}
+    assert conn.get_operation(0).result == {"err": 0}
+
+def test_build_data_model_indexes_bound_connections():
+    """Tests that bound connections are indexed by whether they were closed."""
+    log_file = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test-files', 'access-comprehensive.log'))
+    model = build_data_model(log_file)
+    assert [c.conn_num for c in model.completed_connections] == [100, 101, 103]
+    assert sorted(c.conn_num for c in model.open_connections) == [102, 104]
+
+def test_build_data_model_keeps_reused_connection_numbers(tmp_path):
+    """Tests that connections sharing a number are all kept in the model and its indexes."""
+    log_file = tmp_path / "access"
+    log_file.write_text(REUSED_CONN_LOG)
+    model = build_data_model(str(log_file))
+    assert [c.source_ip for c in model.all_connections] == ["10.0.0.1", "10.0.0.2"]
+    assert model[1] is model.all_connections[-1]
+    assert [c.source_ip for c in model.open_connections] == ["10.0.0.1"]
+    assert [c.source_ip for c in model.completed_connections] == ["10.0.0.2"]
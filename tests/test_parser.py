@@ -1,5 +1,11 @@
 from datetime import datetime, timezone, timedelta
-from log_parser import parse_log_line, parse_timestamp
+import os
+import sys
+import pytest
+import log_parser
+from log_parser import find_chunk_boundaries, parse_log_file, parse_log_line, parse_timestamp
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), '..', 'test-files', 'access-comprehensive.log')
 
 def test_parse_timestamp_zulu():
     ts_str = "10/Jun/2025:21:18:06.100000Z"
@@ -31,6 +37,17 @@ def test_parse_log_line_result():
     assert parsed['op'] == 0
     assert parsed['err'] == 0
 
+def test_parse_key_value_message_result_fast_path():
+    message = 'conn=7 op=2 RESULT err=32 tag=101 nentries=0 wtime=0.000110 optime=0.000262 etime=0.000370'
+    expected = {
+        'conn': 7, 'op': 2, 'err': 32, 'tag': 101, 'nentries': 0,
+        'wtime': '0.000110', 'optime': '0.000262', 'etime': '0.000370', 'type': 'RESULT',
+    }
+    assert log_parser.parse_key_value_message(message) == expected
+    # A RESULT line with further fields takes the generic path
+    parsed = log_parser.parse_key_value_message(message + ' dn="cn=directory manager"')
+    assert parsed == {**expected, 'dn': 'cn=directory manager'}
+
 def test_parse_log_line_closed():
     line = '[10/Jun/2025:21:18:07.200000Z] conn=100 op=-1 fd=12 closed'
     parsed = parse_log_line(line)
@@ -46,3 +63,81 @@ def test_parse_log_line_unindexed():
     assert parsed['type'] == 'RESULT'
     assert parsed['conn'] == 105
     assert parsed['details'] == 'Partially Unindexed Filter'
+
+def test_find_chunk_boundaries_are_line_aligned():
+    chunks = find_chunk_boundaries(LOG_FILE, 4)
+    with open(LOG_FILE, 'rb') as f:
+        data = f.read()
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == len(data)
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+        assert data[start - 1:start] == b'\n'
+
+def test_parse_log_file_parallel_matches_serial():
+    serial = list(parse_log_file(LOG_FILE))
+    assert list(parse_log_file(LOG_FILE, jobs=3)) == serial
+    assert len(serial) == 28
+
+def test_parse_log_file_parallel_small_chunks(monkeypatch):
+    monkeypatch.setattr(log_parser, "PARALLEL_CHUNK_SIZE", 256)
+    assert list(parse_log_file(LOG_FILE, jobs=2)) == list(parse_log_file(LOG_FILE))
+
+def test_parse_log_file_parallel_bounds_chunks_in_flight(monkeypatch):
+    class InlinePool:
+        """Runs chunks in-process and checks how many are submitted but not yet collected."""
+        def __init__(self, processes):
+            self.processes = processes
+            self.in_flight = 0
+            self.max_in_flight = 0
+        def __enter__(self):
+            pools.append(self)
+            return self
+        def __exit__(self, *exc_info):
+            pass
+        def apply_async(self, func, args):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            pool = self
+            class Result:
+                def get(self):
+                    pool.in_flight -= 1
+                    return func(*args)
+            return Result()
+
+    pools = []
+    monkeypatch.setattr(log_parser, "PARALLEL_CHUNK_SIZE", 256)
+    monkeypatch.setattr(log_parser.multiprocessing, "Pool", InlinePool)
+    assert list(parse_log_file(LOG_FILE, jobs=2)) == list(parse_log_file(LOG_FILE))
+    assert pools[0].max_in_flight == 2 * log_parser.PARALLEL_CHUNKS_PER_JOB
+
+def test_parse_log_file_must_contain():
+    parsed = list(parse_log_file(LOG_FILE, must_contain="BIND"))
+    assert parsed and all(line["type"] in ("BIND", "UNBIND") for line in parsed)
+    assert list(parse_log_file(LOG_FILE, jobs=2, must_contain="BIND")) == parsed
+
+def test_main_jobs_matches_serial(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["log_parser", "-f", LOG_FILE])
+    log_parser.main()
+    serial = capsys.readouterr().out
+    monkeypatch.setattr(sys, "argv", ["log_parser", "-f", LOG_FILE, "--jobs", "2"])
+    log_parser.main()
+    assert capsys.readouterr().out == serial
+    assert serial.count("\n") == 28
+
+def test_main_rejects_non_positive_jobs(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["log_parser", "-f", LOG_FILE, "--jobs", "0"])
+    with pytest.raises(SystemExit):
+        log_parser.main()
+    assert "--jobs: must be a positive integer" in capsys.readouterr().err
+
+def test_parse_log_file_parallel_reads_pipes_serially():
+    read_fd, write_fd = os.pipe()
+    with open(LOG_FILE, 'rb') as f:
+        os.write(write_fd, f.read())
+    os.close(write_fd)
+    try:
+        parsed = list(parse_log_file(f"/dev/fd/{read_fd}", jobs=2))
+    finally:
+        os.close(read_fd)
+    assert parsed == list(parse_log_file(LOG_FILE))